@@ -1,5 +1,6 @@
 # mega_secretaria/app/config.py
 
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import os
 
@@ -21,6 +22,25 @@ class Settings(BaseSettings ):
     # Removido: MAX_TOKENS
     HISTORY_MAX_CHARS: int = 1200 # NOVO: Limite de caracteres para o histórico da conversa (aprox. 300 tokens)
 
+    # Configurações do despachante de mensagens de saída (Evolution API)
+    # Os limites (gt/ge) fazem um .env inválido falhar na inicialização, e não durante a entrega
+    OUTBOUND_GLOBAL_RATE_PER_SECOND: float = Field(1.0, gt=0) # Envios por segundo somando todos os destinatários
+    OUTBOUND_GLOBAL_BURST: int = Field(3, ge=1) # Quantos envios podem sair em rajada antes do limite global atuar
+    OUTBOUND_PER_RECIPIENT_INTERVAL_SECONDS: float = Field(1.5, ge=0) # Intervalo mínimo entre envios para o mesmo número
+    OUTBOUND_WORKERS: int = Field(2, ge=1) # Quantidade de workers consumindo a fila de saída
+    OUTBOUND_MAX_RETRIES: int = Field(4, ge=0) # Tentativas adicionais antes de mandar para a dead-letter
+    OUTBOUND_RETRY_BASE_DELAY_SECONDS: float = Field(1.0, ge=0) # Base do backoff exponencial entre tentativas
+    OUTBOUND_RETRY_MAX_DELAY_SECONDS: float = Field(30.0, ge=0)
+    OUTBOUND_TYPING_DELAY_MS: int = Field(1200, ge=0) # Tempo de "digitando..." enviado junto com cada mensagem
+    WHATSAPP_MAX_MESSAGE_CHARS: int = Field(4000, gt=0, le=4096) # O WhatsApp corta textos acima de 4096 caracteres
+
+    # Sinais de progresso enviados enquanto a CrewAI trabalha
+    PRESENCE_DURATION_MS: int = Field(15000, gt=0) # Duração de cada "digitando..." enviado durante o processamento
+    PRESENCE_INITIAL_DURATION_MS: int = Field(1000, gt=0) # Duração do primeiro "digitando...", curta para confirmar o sinal rapidamente
+    PRESENCE_REFRESH_SECONDS: float = Field(10.0, ge=0) # Intervalo mínimo entre renovações do "digitando..." a cada passo da Crew
+    EARLY_ACK_ENABLED: bool = True # Envia um aviso curto assim que o pedido é roteado para o calendário
+    EARLY_ACK_MESSAGE: str = "⏳ Só um instante, estou verificando sua agenda..."
+
 settings = Settings()
 
 # Garante que o diretório do token do Google exista
@@ -3,6 +3,7 @@
 from crewai import Crew, Process
 from app.agents import MegaSecretaryAgents
 from app.tasks import MegaSecretaryTasks
+from app.metrics import prompt_cache_metrics
 
 class MegaSecretaryCrew:
     def __init__(self, user_message: str):
@@ -16,32 +17,45 @@ class MegaSecretaryCrew:
         # Mantido para referência se a arquitetura da Crew mudar para uma mais unificada.
         pass
 
-    def run_calendar_flow(self, history: str = ""): # Adicionado history
+    def _kickoff(self, crew: Crew, flow: str):
+        """Executa a Crew e registra o uso de tokens, incluindo os tokens servidos do cache de prompt."""
+        result = crew.kickoff()
+        token_usage = getattr(result, "token_usage", None)
+        if token_usage is not None:
+            usage = prompt_cache_metrics.record(flow, token_usage)
+            print(
+                f"DEBUG_CREW: Fluxo '{flow}' usou {usage['prompt_tokens']} tokens de prompt "
+                f"({usage['cached_prompt_tokens']} do cache, taxa de acerto {usage['cache_hit_rate']:.0%}) "
+                f"e {usage['completion_tokens']} de resposta."
+            )
+        return result
+
+    def run_calendar_flow(self, history: str = "", step_callback=None): # Adicionado history
         crew = Crew(
             agents=[self.agents.calendar_manager_agent()],
             tasks=[self.tasks.manage_calendar_task(self.user_message, history=history)], # Passa history para a task
             process=Process.sequential,
-            verbose=True
+            verbose=True,
+            step_callback=step_callback # Chamado a cada passo do agente (ex.: para renovar o "digitando...")
         )
-        result = crew.kickoff()
-        return result
+        return self._kickoff(crew, "calendar")
 
-    def run_other_flow(self, history: str = ""): # Adicionado history
+    def run_other_flow(self, history: str = "", step_callback=None): # Adicionado history
         crew = Crew(
             agents=[self.agents.general_chatter_agent()],
             tasks=[self.tasks.general_chat_task(self.user_message, history=history)], # Passa history para a task
             process=Process.sequential,
-            verbose=True
+            verbose=True,
+            step_callback=step_callback # Chamado a cada passo do agente (ex.: para renovar o "digitando...")
         )
-        result = crew.kickoff()
-        return result
+        return self._kickoff(crew, "other")
 
-    def run_routing_flow(self, history: str = ""): # Adicionado history
+    def run_routing_flow(self, history: str = "", step_callback=None): # Adicionado history
         crew = Crew(
             agents=[self.agents.request_router_agent()],
             tasks=[self.tasks.route_request_task(self.user_message, history=history)], # Passa history para a task
             process=Process.sequential,
-            verbose=True
+            verbose=True,
+            step_callback=step_callback # Chamado a cada passo do agente (ex.: para renovar o "digitando...")
         )
-        result = crew.kickoff()
-        return result
\ No newline at end of file
+        return self._kickoff(crew, "routing")
\ No newline at end of file
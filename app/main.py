@@ -6,13 +6,17 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc # NOVO: Importar desc para ordenar
 import uvicorn
 import os
+import time
+import asyncio
 import traceback # Importar traceback para depuração de erros
 
 from app.config import settings
-from app.services.whatsapp_service import send_whatsapp_message
+from app.services.outbound_dispatcher import outbound_dispatcher, DeadLetterNotReplayableError, UNDELIVERED_DEAD_LETTER_STATUSES
 from app.crew import MegaSecretaryCrew
 from app.database import engine, Base, get_db
-from app.models import MessageLog
+from app.models import MessageLog, OutboundDeadLetter
+from app.metrics import prompt_cache_metrics, first_signal_metrics
+from app.services.progress_notifier import ProgressNotifier
 
 # Cria as tabelas no banco de dados (se não existirem)
 Base.metadata.create_all(bind=engine)
@@ -23,22 +27,93 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# Um lock por número de telefone, para processar as mensagens de cada remetente uma de cada vez
+_sender_locks: dict[str, asyncio.Lock] = {}
+
 class WebhookMessage(BaseModel):
     # Adapte este modelo para a estrutura exata do webhook da Evolution API
     # Este é um exemplo simplificado. Consulte a documentação da Evolution API.
     instance: str
     data: dict
 
+@app.on_event("startup")
+async def start_outbound_dispatcher():
+    await outbound_dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_outbound_dispatcher():
+    await outbound_dispatcher.stop()
+
 @app.get("/")
 async def root():
     return {"message": "MegaSecretaria está online!"}
 
+@app.get("/metrics/")
+async def metrics():
+    return {
+        "prompt_cache": prompt_cache_metrics.snapshot(),
+        "time_to_first_signal": first_signal_metrics.snapshot(),
+    }
+
+@app.get("/dead-letters/")
+async def list_dead_letters(status: str | None = None, db: Session = Depends(get_db)):
+    # Sem filtro explícito, lista tudo o que ainda não chegou ao usuário (inclusive reenvios que falharam)
+    statuses = [status] if status else list(UNDELIVERED_DEAD_LETTER_STATUSES)
+    dead_letters = db.query(OutboundDeadLetter).filter(OutboundDeadLetter.status.in_(statuses)).order_by(desc(OutboundDeadLetter.created_at)).all()
+    return [
+        {
+            "id": dl.id,
+            "message_log_id": dl.message_log_id,
+            "phone_number": dl.phone_number,
+            "message_content": dl.message_content,
+            "error": dl.error,
+            "attempts": dl.attempts,
+            "status": dl.status,
+            "created_at": dl.created_at,
+            "replayed_at": dl.replayed_at,
+        }
+        for dl in dead_letters
+    ]
+
+@app.post("/dead-letters/{dead_letter_id}/replay")
+async def replay_dead_letter(dead_letter_id: int, db: Session = Depends(get_db)):
+    try:
+        result = await outbound_dispatcher.replay_dead_letter(dead_letter_id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DeadLetterNotReplayableError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    # Se a mensagem pertence a um log, reflete a nova situação da entrega nele,
+    # desde que não reste outra parte da resposta presa na dead-letter
+    dead_letter = db.query(OutboundDeadLetter).filter(OutboundDeadLetter.id == dead_letter_id).first()
+    if result.delivered and dead_letter and dead_letter.message_log_id:
+        still_undelivered = (
+            db.query(OutboundDeadLetter)
+            .filter(OutboundDeadLetter.message_log_id == dead_letter.message_log_id)
+            .filter(OutboundDeadLetter.status.in_(UNDELIVERED_DEAD_LETTER_STATUSES + ("replaying",)))
+            .count()
+        )
+        log_entry = None if still_undelivered else db.query(MessageLog).filter(MessageLog.id == dead_letter.message_log_id).first()
+        if log_entry and log_entry.status == "delivery_failed":
+            log_entry.status = "processed"
+            db.commit()
+
+    return {
+        "delivered": result.delivered,
+        "chunks_sent": result.chunks_sent,
+        "chunks_total": result.chunks_total,
+        "attempts": result.attempts,
+        "error": result.error,
+    }
+
 @app.post("/webhook/")
 async def whatsapp_webhook(
     webhook_data: WebhookMessage,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
+    received_at = time.monotonic() # Base para medir o tempo até o primeiro sinal ao usuário
     print(f"Webhook recebido: {webhook_data.model_dump_json()}")
 
     # Extrair informações da mensagem
@@ -79,18 +154,28 @@ async def whatsapp_webhook(
         raise HTTPException(status_code=200, detail="Número não autorizado.")
     
     # Se chegou até aqui, a mensagem é válida para processamento, delega para background
-    background_tasks.add_task(process_message_in_background, sender_phone, message_content, log_entry.id, db)
+    background_tasks.add_task(process_message_in_background, sender_phone, message_content, log_entry.id, db, received_at)
     
     return {"status": "processing", "message": "Mensagem recebida e será processada."}
 
 
-async def process_message_in_background(sender_phone: str, user_message: str, log_id: int, db: Session):
+async def process_message_in_background(sender_phone: str, user_message: str, log_id: int, db: Session, received_at: float | None = None):
+    # Mostra "digitando..." imediatamente, antes de qualquer consulta ao banco ou ao LLM
+    notifier = ProgressNotifier(sender_phone, received_at if received_at is not None else time.monotonic())
+    notifier.start()
+
     # Re-obtem o log_entry dentro da função de background para garantir que a sessão está ativa e o objeto persistente
     log_entry = db.query(MessageLog).filter(MessageLog.id == log_id).first()
     if not log_entry:
         print(f"Erro: Log entry com ID {log_id} não encontrado para atualização.")
+        notifier.stop()
         return # Ou trate o erro de outra forma
 
+    # As flows da Crew rodam em thread, então mensagens do mesmo número poderiam ser processadas
+    # em paralelo. O lock por remetente mantém a ordem de chegada: o histórico da próxima mensagem
+    # já inclui a resposta desta, e as respostas entram na fila de saída na mesma ordem.
+    sender_lock = _sender_locks.setdefault(sender_phone, asyncio.Lock())
+    await sender_lock.acquire()
     try:
         # Recupera o histórico da conversa (todas as mensagens para o número, exceto a atual)
         history_entries = db.query(MessageLog).filter(MessageLog.phone_number == sender_phone).filter(MessageLog.id != log_id).order_by(MessageLog.timestamp).all()
@@ -128,7 +213,9 @@ async def process_message_in_background(sender_phone: str, user_message: str, lo
         print(f"Roteando requisição para: {user_message}")
         
         # Passar o histórico para a tarefa de roteamento
-        routing_result = crew_instance.run_routing_flow(history=history_string) 
+        # As flows rodam em uma thread para não travar o event loop, que precisa continuar
+        # enviando o "digitando..." e os avisos enquanto a CrewAI trabalha
+        routing_result = await asyncio.to_thread(crew_instance.run_routing_flow, history=history_string, step_callback=notifier.step_callback)
         intent = str(routing_result).strip().lower() 
         print(f"Intenção detectada: {intent}")
 
@@ -137,22 +224,26 @@ async def process_message_in_background(sender_phone: str, user_message: str, lo
         if "gerenciamento de calendário" in intent:
             print("Iniciando fluxo de gerenciamento de calendário...")
             # Passar o histórico também para o fluxo de calendário
-            crew_result = crew_instance.run_calendar_flow(history=history_string) 
+            if settings.EARLY_ACK_ENABLED:
+                notifier.acknowledge()
+            crew_result = await asyncio.to_thread(crew_instance.run_calendar_flow, history=history_string, step_callback=notifier.step_callback)
             final_response = str(crew_result)
         else: # Assumed to be "outra_requisição" or other non-calendar intent
             print("Iniciando fluxo de outras requisições...")
             # Passar o histórico para o fluxo de chat geral
-            crew_result = crew_instance.run_other_flow(history=history_string)
+            crew_result = await asyncio.to_thread(crew_instance.run_other_flow, history=history_string, step_callback=notifier.step_callback)
             final_response = str(crew_result)
         
         print(f"Resposta final da CrewAI: {final_response}")
 
-        # NOVO PRINT DE DEBUG ANTES DE CHAMAR O SERVIÇO DE WHATSAPP
-        print(f"DEBUG_MAIN: Prestes a chamar send_whatsapp_message para {sender_phone} com a resposta.")
-        await send_whatsapp_message(sender_phone, final_response)
+        print(f"DEBUG_MAIN: Enfileirando a resposta para {sender_phone} no despachante de saída.")
+        delivery = await outbound_dispatcher.dispatch(sender_phone, final_response, log_id=log_id)
+        if delivery.delivered:
+            notifier.record_reply()
 
         log_entry.response_content = final_response
-        log_entry.status = "processed"
+        # Só marca como processada se o usuário de fato recebeu a resposta; falhas ficam na dead-letter
+        log_entry.status = "processed" if delivery.delivered else "delivery_failed"
         db.commit()
 
     except HTTPException as http_exc:
@@ -172,17 +263,21 @@ async def process_message_in_background(sender_phone: str, user_message: str, lo
         print(f"Erro inesperado no processamento da CrewAI para {sender_phone}: {e}")
         traceback.print_exc() # Imprime o rastreamento completo do erro para depuração
         
-        # NOVO PRINT DE DEBUG ANTES DE CHAMAR O SERVIÇO DE WHATSAPP NO ERRO
-        print(f"DEBUG_MAIN: Chamando send_whatsapp_message com mensagem de erro para {sender_phone}.")
-        await send_whatsapp_message(sender_phone, error_message)
+        print(f"DEBUG_MAIN: Enfileirando mensagem de erro para {sender_phone} no despachante de saída.")
+        delivery = await outbound_dispatcher.dispatch(sender_phone, error_message, log_id=log_id)
+        if delivery.delivered:
+            notifier.record_reply()
         
         log_entry.response_content = error_message
         log_entry.status = "error"
         db.commit()
 
     finally:
+        # Encerra o "digitando..." para que nenhuma renovação apareça depois da resposta
+        notifier.stop()
         # Garante que a sessão do banco de dados seja fechada corretamente, mesmo em caso de erro
         db.close() 
+        sender_lock.release()
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,80 @@
+# mega_secretaria/app/metrics.py
+
+import threading
+
+class PromptCacheMetrics:
+    """
+    Acumula, em memória e por fluxo da Crew, o uso de tokens informado pela API do LLM,
+    incluindo os tokens de prompt servidos do cache do provedor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flows: dict[str, dict[str, int]] = {}
+
+    def record(self, flow: str, token_usage) -> dict:
+        """
+        Registra o `token_usage` de um `crew.kickoff()` e retorna os valores normalizados
+        dessa execução (campos ausentes ou None viram 0), junto com a taxa de acerto do cache.
+        """
+        prompt_tokens = getattr(token_usage, "prompt_tokens", 0) or 0
+        cached_tokens = getattr(token_usage, "cached_prompt_tokens", 0) or 0
+        completion_tokens = getattr(token_usage, "completion_tokens", 0) or 0
+        requests = getattr(token_usage, "successful_requests", 0) or 0
+
+        with self._lock:
+            totals = self._flows.setdefault(flow, {
+                "runs": 0, "requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0,
+            })
+            totals["runs"] += 1
+            totals["requests"] += requests
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_prompt_tokens"] += cached_tokens
+            totals["completion_tokens"] += completion_tokens
+
+        return {
+            "prompt_tokens": prompt_tokens,
+            "cached_prompt_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "cache_hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            flows = {name: dict(totals) for name, totals in self._flows.items()}
+        for totals in flows.values():
+            totals["cache_hit_rate"] = (
+                round(totals["cached_prompt_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+            )
+        return flows
+
+prompt_cache_metrics = PromptCacheMetrics()
+
+class FirstSignalMetrics:
+    """
+    Tempo entre o recebimento do webhook e os sinais que de fato chegaram ao usuário,
+    agrupado por tipo: "presence" ("digitando..."), "ack" (aviso de processamento),
+    "reply" (resposta final entregue) e "first" (o mais cedo entre eles para cada mensagem).
+    Toda mensagem respondida gera uma amostra em "first", mesmo quando os avisos falham.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds: dict[str, dict[str, float]] = {}
+
+    def record(self, kind: str, seconds: float):
+        with self._lock:
+            totals = self._kinds.setdefault(kind, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "last_seconds": 0.0})
+            totals["count"] += 1
+            totals["total_seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            totals["last_seconds"] = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            kinds = {name: dict(totals) for name, totals in self._kinds.items()}
+        for totals in kinds.values():
+            totals["avg_seconds"] = round(totals["total_seconds"] / totals["count"], 4) if totals["count"] else 0.0
+        return kinds
+
+first_signal_metrics = FirstSignalMetrics()
@@ -1,6 +1,6 @@
 # mega_secretaria/app/models.py
 
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -12,5 +12,19 @@ class MessageLog(Base):
     message_content = Column(Text, nullable=False)
     response_content = Column(Text, nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    status = Column(String, default="received") # e.g., received, processed, error
+    status = Column(String, default="received") # e.g., received, processed, delivery_failed, error
+
+class OutboundDeadLetter(Base):
+    """Mensagens de saída que esgotaram as tentativas de envio e aguardam reenvio manual."""
+    __tablename__ = "outbound_dead_letters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    message_log_id = Column(Integer, ForeignKey("message_logs.id"), nullable=True, index=True)
+    phone_number = Column(String, index=True, nullable=False)
+    message_content = Column(Text, nullable=False) # Apenas a parte que não chegou a ser entregue
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    status = Column(String, default="pending", index=True) # e.g., pending, replayed, replay_failed
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    replayed_at = Column(DateTime(timezone=True), nullable=True)
 
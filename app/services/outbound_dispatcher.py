@@ -0,0 +1,378 @@
+# mega_secretaria/app/services/outbound_dispatcher.py
+
+import asyncio
+import random
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import httpx
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import OutboundDeadLetter
+from app.services.whatsapp_service import post_text_message
+
+# Só repete o envio quando há certeza de que a Evolution API não processou a mensagem.
+# O sendText não é idempotente: timeouts de leitura e erros de gateway (500/502/504)
+# costumam acontecer depois do envio, e repetir mandaria a mensagem em duplicidade.
+RETRYABLE_STATUS_CODES = {429, 503}
+RETRYABLE_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Situações de dead-letter que ainda não chegaram ao usuário e podem ser reenviadas
+UNDELIVERED_DEAD_LETTER_STATUSES = ("pending", "replay_failed")
+
+class DeadLetterNotReplayableError(Exception):
+    """A dead-letter já foi reenviada ou está sendo reenviada neste momento."""
+    pass
+
+def split_message(text: str, max_chars: int | None = None) -> list[str]:
+    """
+    Divide um texto longo em partes que caibam em uma mensagem do WhatsApp.
+    Prefere quebrar em parágrafos, depois em linhas e depois em espaços; só corta
+    no meio de uma palavra quando não há outra opção. Um separador só é aceito na
+    metade final da janela, para não gerar partes minúsculas (cada parte extra custa
+    mais uma vaga no limite de taxa).
+    """
+    max_chars = max_chars or settings.WHATSAPP_MAX_MESSAGE_CHARS
+    text = text.strip()
+    if not text:
+        return []
+
+    chunks = []
+    while len(text) > max_chars:
+        window = text[:max_chars + 1]
+        cut = max_chars
+        for separator in ("\n\n", "\n", " "):
+            position = window.rfind(separator)
+            if position >= max(1, max_chars // 2):
+                cut = position
+                break
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+@dataclass
+class DeliveryResult:
+    """Resultado da entrega de uma mensagem (todas as suas partes) a um destinatário."""
+    delivered: bool
+    chunks_sent: int
+    chunks_total: int
+    attempts: int = 0
+    error: str | None = None
+    dead_letter_id: int | None = None
+
+@dataclass
+class _OutboundJob:
+    phone_number: str
+    chunks: list[str]
+    log_id: int | None
+    future: asyncio.Future
+    dead_letter_id: int | None = None # Preenchido quando o job é um reenvio de dead-letter
+    retry: bool = True
+    dead_letter: bool = True
+    chunks_sent: int = 0
+    attempts: int = 0 # Tentativas de envio somando todas as partes
+    chunk_attempts: int = 0 # Tentativas da parte atual
+
+class _TokenBucket:
+    """Limite global de envios por segundo, permitindo uma pequena rajada."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class OutboundDispatcher:
+    """
+    Fila de saída para a Evolution API.
+    Aplica limites de taxa global e por destinatário, divide respostas longas em partes,
+    tenta novamente com backoff exponencial e registra em `outbound_dead_letters`
+    as mensagens que não puderam ser entregues.
+
+    Cada destinatário tem sua própria fila (mantendo a ordem das mensagens) e aparece
+    no máximo uma vez na fila de prontos. Esperas de backoff e de intervalo por
+    destinatário são agendadas com `call_later`, então nenhum worker fica parado
+    esperando enquanto outros destinatários têm mensagens prontas.
+    """
+
+    def __init__(self):
+        self.ready: asyncio.Queue | None = None
+        self.workers: list[asyncio.Task] = []
+        self.global_limiter: _TokenBucket | None = None
+        self.pending: dict[str, deque[_OutboundJob]] = {}
+        self.recipient_last_sent: dict[str, float] = {}
+        self.timers: set[asyncio.TimerHandle] = set()
+
+    async def start(self):
+        if self.workers:
+            return
+        self._release_stale_replays()
+        self.ready = asyncio.Queue()
+        self.global_limiter = _TokenBucket(settings.OUTBOUND_GLOBAL_RATE_PER_SECOND, settings.OUTBOUND_GLOBAL_BURST)
+        self.workers = [
+            asyncio.create_task(self._worker(i)) for i in range(max(1, settings.OUTBOUND_WORKERS))
+        ]
+        print(f"DEBUG_DISPATCHER: {len(self.workers)} worker(s) de saída iniciados.")
+
+    async def stop(self):
+        for timer in self.timers:
+            timer.cancel()
+        self.timers.clear()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+        # Resolve tudo o que ainda estava na fila ou em envio, para que quem chamou
+        # `dispatch()` não fique esperando para sempre durante o desligamento
+        for jobs in self.pending.values():
+            for job in jobs:
+                self._fail(job, "Despachante de saída encerrado antes da entrega.")
+        self.pending.clear()
+
+    async def dispatch(self, phone_number: str, message: str, log_id: int | None = None, retry: bool = True, dead_letter: bool = True) -> DeliveryResult:
+        """
+        Enfileira uma mensagem e aguarda até que ela seja entregue ou vá para a dead-letter.
+        Com `retry=False, dead_letter=False` o envio é de melhor esforço (uma única tentativa,
+        sem registro), adequado para avisos que perdem o sentido se chegarem atrasados.
+        """
+        return await self._enqueue(phone_number, split_message(message), log_id, retry=retry, dead_letter=dead_letter)
+
+    async def replay_dead_letter(self, dead_letter_id: int) -> DeliveryResult:
+        """
+        Reenfileira uma mensagem da dead-letter. Só aceita registros ainda não entregues,
+        e os marca como "replaying" na mesma transação para impedir reenvios simultâneos.
+        Uma nova falha atualiza o mesmo registro.
+        """
+        db = SessionLocal()
+        try:
+            claimed = (
+                db.query(OutboundDeadLetter)
+                .filter(OutboundDeadLetter.id == dead_letter_id)
+                .filter(OutboundDeadLetter.status.in_(UNDELIVERED_DEAD_LETTER_STATUSES))
+                .update({OutboundDeadLetter.status: "replaying"}, synchronize_session=False)
+            )
+            db.commit()
+            dead_letter = db.query(OutboundDeadLetter).filter(OutboundDeadLetter.id == dead_letter_id).first()
+            if not dead_letter:
+                raise LookupError(f"Dead-letter com ID {dead_letter_id} não encontrada.")
+            if not claimed:
+                raise DeadLetterNotReplayableError(
+                    f"Dead-letter com ID {dead_letter_id} não pode ser reenviada (situação atual: {dead_letter.status})."
+                )
+            phone_number, content, log_id = dead_letter.phone_number, dead_letter.message_content, dead_letter.message_log_id
+        finally:
+            db.close()
+        return await self._enqueue(phone_number, split_message(content), log_id, dead_letter_id=dead_letter_id)
+
+    async def _enqueue(self, phone_number: str, chunks: list[str], log_id: int | None, dead_letter_id: int | None = None, retry: bool = True, dead_letter: bool = True) -> DeliveryResult:
+        if not chunks:
+            if dead_letter_id is not None:
+                self._mark_dead_letter_replayed(dead_letter_id)
+            return DeliveryResult(delivered=True, chunks_sent=0, chunks_total=0)
+        if not self.workers:
+            # Sem o evento de startup (ex.: scripts), garante que a fila esteja rodando
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        jobs = self.pending.setdefault(phone_number, deque())
+        jobs.append(_OutboundJob(phone_number, chunks, log_id, future, dead_letter_id, retry=retry, dead_letter=dead_letter))
+        if len(jobs) == 1:
+            # Destinatário ocioso: entra na fila de prontos respeitando o intervalo mínimo
+            self._schedule(phone_number, self._recipient_wait(phone_number))
+        return await future
+
+    async def _worker(self, worker_id: int):
+        while True:
+            phone_number = await self.ready.get()
+            jobs = self.pending.get(phone_number)
+            job = jobs[0] if jobs else None
+            try:
+                if job:
+                    await self._send_next_chunk(job)
+            except Exception as e:
+                traceback.print_exc()
+                if not job.future.done():
+                    self._finish(job, self._dead_letter(job, f"Erro inesperado: {e}"))
+            finally:
+                self.ready.task_done()
+
+    async def _send_next_chunk(self, job: _OutboundJob):
+        phone_number = job.phone_number
+        await self.global_limiter.acquire()
+        job.attempts += 1
+        job.chunk_attempts += 1
+        try:
+            await post_text_message(phone_number, job.chunks[job.chunks_sent])
+            error = None
+        except httpx.HTTPStatusError as exc:
+            error = f"Erro HTTP: {exc.response.status_code} - {exc.response.text}"
+            retryable = exc.response.status_code in RETRYABLE_STATUS_CODES
+            retry_after = exc.response.headers.get("Retry-After")
+        except httpx.RequestError as exc:
+            error = f"Erro de requisição ({type(exc).__name__}): {exc}"
+            retryable = isinstance(exc, RETRYABLE_REQUEST_ERRORS)
+            retry_after = None
+        finally:
+            self.recipient_last_sent[phone_number] = time.monotonic()
+
+        if error is None:
+            job.chunks_sent += 1
+            job.chunk_attempts = 0
+            if job.chunks_sent == len(job.chunks):
+                self._finish(job, DeliveryResult(
+                    delivered=True, chunks_sent=job.chunks_sent, chunks_total=len(job.chunks), attempts=job.attempts
+                ))
+                if job.dead_letter_id is not None:
+                    self._mark_dead_letter_replayed(job.dead_letter_id)
+            else:
+                self._schedule(phone_number, self._recipient_wait(phone_number))
+            return
+
+        if not job.retry or not retryable or job.chunk_attempts > settings.OUTBOUND_MAX_RETRIES:
+            self._finish(job, self._dead_letter(job, error))
+            return
+
+        delay = min(
+            settings.OUTBOUND_RETRY_MAX_DELAY_SECONDS,
+            settings.OUTBOUND_RETRY_BASE_DELAY_SECONDS * (2 ** (job.chunk_attempts - 1)),
+        )
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        delay += random.uniform(0, delay / 2) # Jitter para não sincronizar as novas tentativas
+        print(f"DEBUG_DISPATCHER: Tentativa {job.chunk_attempts} para {phone_number} falhou ({error}). Nova tentativa em {delay:.1f}s.")
+        self._schedule(phone_number, delay)
+
+    def _finish(self, job: _OutboundJob, result: DeliveryResult):
+        """Resolve o job à frente da fila do destinatário e libera o próximo, se houver."""
+        jobs = self.pending.get(job.phone_number)
+        if jobs and jobs[0] is job:
+            jobs.popleft()
+            if jobs:
+                self._schedule(job.phone_number, self._recipient_wait(job.phone_number))
+            else:
+                del self.pending[job.phone_number]
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _fail(self, job: _OutboundJob, error: str):
+        """Resolve um job que não será mais processado, guardando o que faltou enviar."""
+        if not job.future.done():
+            job.future.set_result(self._dead_letter(job, error))
+
+    def _dead_letter(self, job: _OutboundJob, error: str) -> DeliveryResult:
+        dead_letter_id = None
+        if job.dead_letter:
+            remaining = "\n\n".join(job.chunks[job.chunks_sent:])
+            dead_letter_id = self._record_dead_letter(job, remaining, error, job.attempts)
+            print(f"ERRO_DISPATCHER: Falha ao entregar para {job.phone_number} (parte {job.chunks_sent + 1}/{len(job.chunks)}). Dead-letter {dead_letter_id}: {error}")
+        else:
+            # Envios de melhor esforço (ex.: aviso de processamento) não são falhas de entrega da resposta
+            print(f"AVISO: Envio de melhor esforço para {job.phone_number} não foi entregue: {error}")
+        return DeliveryResult(
+            delivered=False, chunks_sent=job.chunks_sent, chunks_total=len(job.chunks),
+            attempts=job.attempts, error=error, dead_letter_id=dead_letter_id
+        )
+
+    def _schedule(self, phone_number: str, delay: float):
+        """Coloca o destinatário na fila de prontos depois de `delay` segundos, sem ocupar um worker."""
+        if delay <= 0:
+            self.ready.put_nowait(phone_number)
+            return
+        loop = asyncio.get_running_loop()
+        timer = None
+
+        def _ready():
+            self.timers.discard(timer)
+            self.ready.put_nowait(phone_number)
+
+        timer = loop.call_later(delay, _ready)
+        self.timers.add(timer)
+
+    def _recipient_wait(self, phone_number: str) -> float:
+        last_sent = self.recipient_last_sent.get(phone_number)
+        if last_sent is None:
+            return 0.0
+        return settings.OUTBOUND_PER_RECIPIENT_INTERVAL_SECONDS - (time.monotonic() - last_sent)
+
+    def _record_dead_letter(self, job: _OutboundJob, content: str, error: str, attempts: int) -> int | None:
+        db = SessionLocal()
+        try:
+            if job.dead_letter_id is not None:
+                dead_letter = db.query(OutboundDeadLetter).filter(OutboundDeadLetter.id == job.dead_letter_id).first()
+                dead_letter.message_content = content
+                dead_letter.error = error
+                dead_letter.attempts = (dead_letter.attempts or 0) + attempts
+                dead_letter.status = "replay_failed"
+            else:
+                dead_letter = OutboundDeadLetter(
+                    message_log_id=job.log_id,
+                    phone_number=job.phone_number,
+                    message_content=content,
+                    error=error,
+                    attempts=attempts,
+                    status="pending",
+                )
+                db.add(dead_letter)
+            db.commit()
+            return dead_letter.id
+        except Exception as e:
+            print(f"ERRO_DISPATCHER: Não foi possível registrar a dead-letter para {job.phone_number}: {e}")
+            db.rollback()
+            return None
+        finally:
+            db.close()
+
+    def _release_stale_replays(self):
+        """
+        Reenvios só saem de "replaying" dentro deste processo. Se ele caiu no meio de um
+        reenvio, o registro ficaria preso para sempre; ao iniciar, volta para "replay_failed".
+        """
+        db = SessionLocal()
+        try:
+            released = (
+                db.query(OutboundDeadLetter)
+                .filter(OutboundDeadLetter.status == "replaying")
+                .update({OutboundDeadLetter.status: "replay_failed"}, synchronize_session=False)
+            )
+            db.commit()
+            if released:
+                print(f"DEBUG_DISPATCHER: {released} dead-letter(s) presas em 'replaying' voltaram para 'replay_failed'.")
+        except Exception as e:
+            print(f"ERRO_DISPATCHER: Não foi possível liberar dead-letters presas em 'replaying': {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _mark_dead_letter_replayed(self, dead_letter_id: int):
+        db = SessionLocal()
+        try:
+            dead_letter = db.query(OutboundDeadLetter).filter(OutboundDeadLetter.id == dead_letter_id).first()
+            if dead_letter:
+                dead_letter.status = "replayed"
+                dead_letter.replayed_at = datetime.now(timezone.utc)
+                db.commit()
+        except Exception as e:
+            print(f"ERRO_DISPATCHER: Não foi possível marcar a dead-letter {dead_letter_id} como reenviada: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+outbound_dispatcher = OutboundDispatcher()
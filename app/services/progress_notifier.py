@@ -0,0 +1,108 @@
+# mega_secretaria/app/services/progress_notifier.py
+
+import asyncio
+import time
+
+from app.config import settings
+from app.metrics import first_signal_metrics
+from app.services.outbound_dispatcher import outbound_dispatcher
+from app.services.whatsapp_service import send_presence
+
+class ProgressNotifier:
+    """
+    Mantém o usuário informado enquanto a CrewAI processa uma mensagem:
+    envia "digitando..." logo no início, renova esse status a cada passo da Crew
+    e pode mandar um aviso curto antes da resposta final. Também registra o tempo
+    entre o recebimento do webhook e cada tipo de sinal que de fato chegou ao usuário.
+    """
+
+    def __init__(self, phone_number: str, received_at: float):
+        self.phone_number = phone_number
+        self.received_at = received_at # time.monotonic() de quando o webhook chegou
+        self.loop = asyncio.get_running_loop()
+        self.stopped = False
+        self.last_presence_at = 0.0
+        self.signals: dict[str, float] = {} # Tipo de sinal -> segundos desde o webhook
+        self.background_tasks: set[asyncio.Task] = set()
+
+    def start(self):
+        """
+        Envia o primeiro "digitando..." sem bloquear o processamento. Ele usa uma duração
+        curta para que a confirmação da Evolution API chegue logo (e o sinal possa ser medido),
+        e em seguida é renovado com a duração normal.
+        """
+        self._send_presence(settings.PRESENCE_INITIAL_DURATION_MS, renew=True)
+
+    def stop(self):
+        """
+        Encerra os sinais de progresso: impede novas renovações do "digitando..." e cancela
+        as requisições ainda pendentes. Registra também o primeiro sinal, qualquer que seja o tipo.
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        for task in list(self.background_tasks):
+            task.cancel()
+        if self.signals:
+            first_signal_metrics.record("first", min(self.signals.values()))
+
+    def record_reply(self):
+        """Registra a entrega da resposta final, que também conta como sinal visível ao usuário."""
+        self._record_signal("reply", time.monotonic())
+
+    def step_callback(self, step):
+        """
+        Passado como `step_callback` da Crew. Roda na thread da CrewAI, por isso só agenda
+        a renovação do "digitando..." no event loop, respeitando PRESENCE_REFRESH_SECONDS.
+        """
+        if self.stopped or time.monotonic() - self.last_presence_at < settings.PRESENCE_REFRESH_SECONDS:
+            return
+        self.loop.call_soon_threadsafe(self._send_presence)
+
+    def acknowledge(self, message: str | None = None):
+        """
+        Envia um aviso curto ao usuário sem aguardar a entrega. É de melhor esforço:
+        uma única tentativa, sem dead-letter e sem vínculo com o log da mensagem,
+        para não atrasar nem se confundir com a resposta de verdade.
+        """
+        if self.stopped:
+            return
+        self._spawn(self._acknowledge(message or settings.EARLY_ACK_MESSAGE))
+
+    def _send_presence(self, delay_ms: int | None = None, renew: bool = False):
+        if self.stopped:
+            return
+        self.last_presence_at = time.monotonic()
+        self._spawn(self._presence(delay_ms or settings.PRESENCE_DURATION_MS, renew))
+
+    async def _presence(self, delay_ms: int, renew: bool):
+        try:
+            await send_presence(self.phone_number, delay_ms=delay_ms)
+        except Exception as e:
+            print(f"AVISO: Não foi possível enviar 'digitando...' para {self.phone_number}: {e}")
+            return
+        # A Evolution API mostra o "digitando..." e só responde depois de `delay_ms`,
+        # então o status apareceu para o usuário `delay_ms` antes desta resposta.
+        shown_at = time.monotonic() - delay_ms / 1000
+        self._record_signal("presence", max(shown_at, self.received_at))
+        if renew:
+            self._send_presence()
+
+    async def _acknowledge(self, message: str):
+        delivery = await outbound_dispatcher.dispatch(self.phone_number, message, retry=False, dead_letter=False)
+        if delivery.delivered:
+            self._record_signal("ack", time.monotonic())
+
+    def _record_signal(self, kind: str, at: float):
+        """Registra a primeira ocorrência de cada tipo de sinal para esta mensagem."""
+        if kind in self.signals:
+            return
+        elapsed = at - self.received_at
+        self.signals[kind] = elapsed
+        first_signal_metrics.record(kind, elapsed)
+        print(f"DEBUG_PROGRESS: Sinal '{kind}' para {self.phone_number} visível {elapsed * 1000:.0f} ms após o webhook.")
+
+    def _spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
@@ -4,19 +4,33 @@ import httpx
 from app.config import settings
 import json # Importar json para depuração do payload
 
-async def send_whatsapp_message(phone_number: str, message: str):
-    """
-    Envia uma mensagem de texto via Evolution API.
-    """
-    url = f"{settings.EVOLUTION_API_URL}/message/sendText/{settings.EVOLUTION_API_INSTANCE_NAME}"
-    headers = {
+def _evolution_headers() -> dict:
+    return {
         "Content-Type": "application/json",
         "apikey": settings.EVOLUTION_API_KEY  # <--- MUDANÇA CRÍTICA: Use "apikey" como no código antigo
     }
+
+def _json_or_none(response: httpx.Response):
+    """
+    Retorna o corpo JSON da resposta, ou None se ele não for JSON. Qualquer 2xx já significa
+    que a Evolution API aceitou o envio; um corpo inesperado não pode virar falha de entrega.
+    """
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+async def post_text_message(phone_number: str, message: str, delay_ms: int | None = None):
+    """
+    Envia um único texto via Evolution API e levanta exceções do httpx em caso de falha.
+    Respostas ao usuário devem passar por `outbound_dispatcher.dispatch`, que aplica os
+    limites de taxa e decide se a falha merece nova tentativa.
+    """
+    url = f"{settings.EVOLUTION_API_URL}/message/sendText/{settings.EVOLUTION_API_INSTANCE_NAME}"
     payload = {
         "number": phone_number,
         "options": {
-            "delay": 1200,
+            "delay": settings.OUTBOUND_TYPING_DELAY_MS if delay_ms is None else delay_ms,
             "presence": "composing", # Adicionado do código antigo
             "linkPreview": False # Adicionado do código antigo
         },
@@ -25,26 +39,30 @@ async def send_whatsapp_message(phone_number: str, message: str):
 
     # Debug logs mais detalhados
     print(f"DEBUG: Tentando enviar mensagem para a URL: {url}")
-    print(f"DEBUG: Headers da Requisição: {headers}")
     print(f"DEBUG: Payload da Requisição: {json.dumps(payload, indent=2)}") # Imprime o payload formatado
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=payload, timeout=30.0) # httpx usa 'json' para dics
-            response.raise_for_status()  # Levanta uma exceção para códigos de status HTTP 4xx/5xx
-
-            print(f"DEBUG: Mensagem enviada com sucesso para {phone_number}. Status HTTP: {response.status_code}")
-            print(f"DEBUG: Resposta completa da Evolution API: {response.text}") # Imprime a resposta completa da API
-            return response.json()
-    except httpx.RequestError as exc:
-        print(f"ERRO DE REQUISIÇÃO (httpx.RequestError) ao enviar mensagem para {phone_number}: {exc}")
-        return {"status": "error", "message": f"Erro de requisição: {exc}"}
-    except httpx.HTTPStatusError as exc:
-        # Este bloco DEVE capturar erros como 401 (Auth) ou 400 (Bad Request)
-        print(f"ERRO HTTP (httpx.HTTPStatusError) ao enviar mensagem para {phone_number}: Status {exc.response.status_code} - Body: {exc.response.text}")
-        return {"status": "error", "message": f"Erro HTTP: {exc.response.status_code} - {exc.response.text}"}
-    except Exception as e:
-        print(f"ERRO INESPERADO ao enviar mensagem para {phone_number}: {e}")
-        import traceback
-        traceback.print_exc() # Imprime o rastreamento completo do erro para depuração
-        return {"status": "error", "message": f"Erro inesperado: {e}"}
\ No newline at end of file
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, headers=_evolution_headers(), json=payload, timeout=30.0) # httpx usa 'json' para dics
+        response.raise_for_status()  # Levanta uma exceção para códigos de status HTTP 4xx/5xx
+
+        print(f"DEBUG: Mensagem enviada com sucesso para {phone_number}. Status HTTP: {response.status_code}")
+        print(f"DEBUG: Resposta completa da Evolution API: {response.text}") # Imprime a resposta completa da API
+        return _json_or_none(response)
+
+async def send_presence(phone_number: str, presence: str = "composing", delay_ms: int | None = None):
+    """
+    Mostra um status de presença (ex.: "digitando...") para o usuário via Evolution API.
+    A Evolution API só responde depois que `delay_ms` termina, então quem chama normalmente
+    não deve aguardar esta corrotina no caminho crítico. Levanta exceções do httpx em caso de falha.
+    """
+    url = f"{settings.EVOLUTION_API_URL}/chat/sendPresence/{settings.EVOLUTION_API_INSTANCE_NAME}"
+    payload = {
+        "number": phone_number,
+        "delay": settings.PRESENCE_DURATION_MS if delay_ms is None else delay_ms,
+        "presence": presence,
+    }
+    async with httpx.AsyncClient() as client:
+        timeout = payload["delay"] / 1000 + 30.0
+        response = await client.post(url, headers=_evolution_headers(), json=payload, timeout=timeout)
+        response.raise_for_status()
+        return _json_or_none(response)
@@ -8,25 +8,12 @@ from app.tools.google_calendar_tools import CreateCalendarEventTool, ListCalenda
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-class MegaSecretaryTasks:
-    def __init__(self):
-        self.agents = MegaSecretaryAgents()
-        # Define o fuso horário de São Paulo
-        self.sao_paulo_tz = ZoneInfo("America/Sao_Paulo")
-
-    def _get_current_time_context(self):
-        """Retorna uma string com a data e hora atuais para injetar nos prompts."""
-        now = datetime.now(self.sao_paulo_tz).strftime('%A, %d de %B de %Y, %H:%M:%S')
-        return f"Contexto Atual: A data e hora exatas agora em São Paulo são: {now}. Use esta informação para interpretar referências relativas como 'hoje', 'amanhã' ou 'semana que vem'."
-
-    def route_request_task(self, user_message: str, history: str = ""): # Adicionado history
-        return Task(
-            description=f"""
-            {self._get_current_time_context()}
-            {history} # Injeta o histórico aqui
-
-            Analise a seguinte mensagem do usuário e determine a intenção principal:
-            "{user_message}"
+# Instruções estáticas de cada task. Elas precisam vir ANTES de qualquer dado variável
+# (hora, histórico, mensagem) para que o prefixo do prompt seja sempre o mesmo e o
+# cache de prompt do provedor (ex.: OpenAI) possa ser reaproveitado entre requisições.
+ROUTE_REQUEST_INSTRUCTIONS = """
+            Analise a mensagem do usuário informada ao final e determine a intenção principal.
+            Considere também o contexto atual e o histórico da conversa, quando houver.
 
             Se a mensagem for sobre criar, listar, consultar ou gerenciar eventos/compromissos/reuniões no calendário,
             a intenção é **'gerenciamento de calendário'**.
@@ -35,19 +22,10 @@ class MegaSecretaryTasks:
 
             Sua saída DEVE ser EXATAMENTE uma das duas strings fornecidas, sem espaços extras, capitalização diferente ou caracteres adicionais:
             'gerenciamento de calendário' ou 'outra_requisição'.
-            """,
-            expected_output="Uma das strings: 'gerenciamento de calendário' ou 'outra_requisição'.",
-            agent=self.agents.request_router_agent()
-        )
-
-    def manage_calendar_task(self, user_message: str, history: str = ""):
-        return Task(
-            description=f"""
-            {self._get_current_time_context()}
-            {history}
+"""
 
-            Com base na mensagem do usuário e no histórico da conversa, gerencie o Google Calendar.
-            A mensagem do usuário é: "{user_message}"
+MANAGE_CALENDAR_INSTRUCTIONS = """
+            Com base na mensagem do usuário (informada ao final) e no histórico da conversa, gerencie o Google Calendar.
 
             Você deve ser capaz de:
             - **Criar eventos**: se o usuário pedir para criar um compromisso, reunião, lembrete, etc. Para criar um evento, você precisará de:
@@ -71,7 +49,49 @@ class MegaSecretaryTasks:
             - Se eventos forem listados: Retorne **EXATAMENTE** a saída completa da ferramenta `List Calendar Events` (que já virá formatada) OU a mensagem de "Nenhum compromisso agendado para o período especificado", seguida de uma frase amigável para perguntar se o usuário precisa de mais alguma coisa ou se deseja deletar um evento listado usando o ID.
             - Se um evento for deletado: Uma resposta formatada confirmando a exclusão, baseada na saída da ferramenta. Exemplo: '✅ Evento com ID 'seu_id_do_evento' deletado com sucesso.'
             - Se faltar informação: Uma pergunta clara ao usuário solicitando os dados necessários.
-            """,
+"""
+
+GENERAL_CHAT_INSTRUCTIONS = """
+            A requisição do usuário não é sobre gerenciamento de calendário.
+            Responda à pergunta do usuário (informada ao final) de forma útil e amigável.
+            Tente responder a perguntas gerais ou continuar uma conversa.
+            Se não souber a resposta, peça desculpas e ofereça ajuda com outra coisa.
+"""
+
+class MegaSecretaryTasks:
+    def __init__(self):
+        self.agents = MegaSecretaryAgents()
+        # Define o fuso horário de São Paulo
+        self.sao_paulo_tz = ZoneInfo("America/Sao_Paulo")
+
+    def _get_current_time_context(self):
+        """Retorna uma string com a data e hora atuais para injetar nos prompts."""
+        now = datetime.now(self.sao_paulo_tz).strftime('%A, %d de %B de %Y, %H:%M:%S')
+        return f"Contexto Atual: A data e hora exatas agora em São Paulo são: {now}. Use esta informação para interpretar referências relativas como 'hoje', 'amanhã' ou 'semana que vem'."
+
+    def _build_description(self, instructions: str, user_message: str, history: str = ""):
+        """
+        Monta a descrição da task com as instruções estáticas primeiro e as partes voláteis
+        (hora atual, histórico e mensagem) no final. Assim o prefixo do prompt fica idêntico
+        entre requisições e o cache de prompt do provedor consegue ser aproveitado.
+        """
+        return f"""{instructions}
+            ----- Dados desta Requisição -----
+            {self._get_current_time_context()}
+            {history}
+            Mensagem do usuário: "{user_message}"
+            """
+
+    def route_request_task(self, user_message: str, history: str = ""): # Adicionado history
+        return Task(
+            description=self._build_description(ROUTE_REQUEST_INSTRUCTIONS, user_message, history),
+            expected_output="Uma das strings: 'gerenciamento de calendário' ou 'outra_requisição'.",
+            agent=self.agents.request_router_agent()
+        )
+
+    def manage_calendar_task(self, user_message: str, history: str = ""):
+        return Task(
+            description=self._build_description(MANAGE_CALENDAR_INSTRUCTIONS, user_message, history),
             expected_output="Uma resposta formatada confirmando a criação, listagem ou exclusão de um evento do Google Calendar, ou uma pergunta clara ao usuário sobre informações faltantes.", # <--- Linha adicionada/modificada
             agent=self.agents.calendar_manager_agent(),
             tools=[CreateCalendarEventTool(), ListCalendarEventsTool(), DeleteCalendarEventTool()]
@@ -79,17 +99,7 @@ class MegaSecretaryTasks:
 
     def general_chat_task(self, user_message: str, history: str = ""): # Adicionado history
         return Task(
-            description=f"""
-            {self._get_current_time_context()}
-            {history} # Injeta o histórico aqui
-
-            A requisição do usuário não é sobre gerenciamento de calendário.
-            Responda à pergunta do usuário de forma útil e amigável.
-            Tente responder a perguntas gerais ou continuar uma conversa.
-            Se não souber a resposta, peça desculpas e ofereça ajuda com outra coisa.
-
-            Mensagem do usuário: "{user_message}"
-            """,
+            description=self._build_description(GENERAL_CHAT_INSTRUCTIONS, user_message, history),
             expected_output="Uma resposta útil e amigável à pergunta do usuário.",
             agent=self.agents.general_chatter_agent()
-        )
\ No newline at end of file
+        )